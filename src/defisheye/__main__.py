@@ -22,7 +22,7 @@ Copyright [2019] [E. S. Pereira]
 """
 import os
 import argparse
-from .defisheye import Defisheye
+from .defisheye import Defisheye, INTERPOLATIONS, BORDERS
 from .defisheyeapp import DefisheyeApp
 
 import argcomplete
@@ -42,23 +42,41 @@ def get_images(input_dir, out_dir, types_images: list = ["png", "jpg", "jpeg"]):
     return zip(input_images, output_images)
 
 
-def process_image(input_image, output_image, **kwargs):
+def process_image(input_image, output_image, views=None, **kwargs):
     obj = Defisheye(input_image, **kwargs)
+    if views is not None:
+        return obj.convert_views(views, outfile=output_image)
     return obj.convert(outfile=output_image)
 
 
-def batch_process(input_dir, output_dir, **kwargs):
+def batch_process(input_dir, output_dir, views=None, **kwargs):
     to_process = get_images(input_dir, output_dir)
 
     def individual(image_info):
         input_image = image_info[0]
         output_image = image_info[1]
-        return process_image(input_image, output_image, **kwargs)
+        return process_image(input_image, output_image, views=views,
+                             **kwargs)
 
     for in_out_image in tqdm(list(to_process)):
         individual(in_out_image)
 
 
+def parse_views(value):
+    """
+    Parse "yaw:pitch,yaw:pitch,..." view directions, in degrees.
+    """
+    views = []
+    for view in value.split(","):
+        try:
+            yaw, pitch = [float(v) for v in view.split(":")]
+        except ValueError:
+            raise argparse.ArgumentTypeError(
+                "Invalid view {}, use yaw:pitch".format(view))
+        views.append((yaw, pitch))
+    return views
+
+
 def mainapp():
     app = DefisheyeApp()
     app.run()
@@ -106,10 +124,34 @@ def main():
     parser.add_argument("--format", type=str, default="fullframe",
                         help="output directory", required=False)
 
+    parser.add_argument("--interpolation", type=str, default="linear",
+                        choices=list(INTERPOLATIONS),
+                        help="Remap interpolation, from fastest (nearest) "
+                        "to highest quality (lanczos4)", required=False)
+
+    parser.add_argument("--border", type=str, default="constant",
+                        choices=list(BORDERS),
+                        help="Border mode for pixels outside the fisheye "
+                        "image", required=False)
+
+    parser.add_argument("--roi", type=int, nargs=4, default=None,
+                        metavar=("X", "Y", "WIDTH", "HEIGHT"),
+                        help="Output rectangle to compute, only pixels "
+                        "in the fisheye disc are remapped", required=False)
+
+    parser.add_argument("--views", type=parse_views, default=None,
+                        metavar="YAW:PITCH,...",
+                        help="Perspective views to extract, one image per "
+                        "view. E.g. --views=0:0,-90:0,90:0,0:90",
+                        required=False)
+
     argcomplete.autocomplete(parser)
 
     cfg = parser.parse_args()
 
+    if cfg.views is not None and cfg.roi is not None:
+        parser.error("--roi can not be used with --views")
+
     vkwargs = {"fov": cfg.fov,
                "pfov": cfg.pfov,
                "xcenter": cfg.xcenter,
@@ -118,7 +160,10 @@ def main():
                "angle": cfg.angle,
                "dtype": cfg.dtype,
                "format": cfg.format,
-               "pad": cfg.pad
+               "pad": cfg.pad,
+               "interpolation": cfg.interpolation,
+               "border": cfg.border,
+               "roi": cfg.roi
                }
 
     if cfg.image is not None:
@@ -132,6 +177,10 @@ def main():
 
         os.makedirs(outdir, exist_ok=True)
 
+        process_image(cfg.image,
+                      os.path.join(outdir, os.path.basename(cfg.image)),
+                      views=cfg.views, **vkwargs)
+
     elif cfg.images_folder is not None:
         if cfg.save_dir is None:
             normpath = os.path.normpath(cfg.images_folder)
@@ -142,7 +191,7 @@ def main():
 
         os.makedirs(outdir, exist_ok=True)
 
-        batch_process(cfg.images_folder, outdir, **vkwargs)
+        batch_process(cfg.images_folder, outdir, views=cfg.views, **vkwargs)
 
     else:
         raise Exception(msg="Nor image neither images folder passed.")
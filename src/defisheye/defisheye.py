@@ -23,11 +23,38 @@ Copyright [2019] [E. S. Pereira]
    See the License for the specific language governing permissions and
    limitations under the License.
 """
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import cv2
-from numpy import arange, sqrt, arctan, sin, tan, meshgrid, pi, pad
-from numpy import ndarray, hypot
+from numpy import arange, sqrt, arctan, arctan2, sin, cos, tan, meshgrid
+from numpy import ndarray, hypot, pi
 import numpy as np
 
+INTERPOLATIONS = {"nearest": cv2.INTER_NEAREST,
+                  "linear": cv2.INTER_LINEAR,
+                  "cubic": cv2.INTER_CUBIC,
+                  "lanczos4": cv2.INTER_LANCZOS4
+                  }
+
+BORDERS = {"constant": cv2.BORDER_CONSTANT,
+           "replicate": cv2.BORDER_REPLICATE,
+           "reflect": cv2.BORDER_REFLECT,
+           "reflect101": cv2.BORDER_REFLECT_101,
+           "wrap": cv2.BORDER_WRAP
+           }
+
+# Remap tables of perspective views, shared by every Defisheye instance
+# with the same camera parameters (see Defisheye.convert_views). The
+# oldest views are dropped once the tables exceed VIEW_CACHE_BYTES.
+VIEW_CACHE_BYTES = 256 * 2 ** 20
+_VIEW_MAPS = {}
+# _VIEW_LOCK guards _VIEW_MAPS and _VIEW_BUILDING, which holds one lock per
+# key being built so that each view is computed only once.
+_VIEW_LOCK = threading.Lock()
+_VIEW_BUILDING = {}
+
+
 class Defisheye:
     """
     Defisheye
@@ -41,6 +68,11 @@ class Defisheye:
     angle: image rotation in degrees clockwise
     dtype: linear, equalarea, orthographic, stereographic
     format: circular, fullframe
+    interpolation: nearest, linear, cubic, lanczos4
+    border: constant, replicate, reflect, reflect101, wrap
+    roi: output rectangle (x, y, width, height) to compute. Only the
+         box of its pixels that fall in the fisheye disc is remapped,
+         the pixels outside the disc are set to zero
     """
 
     def __init__(self, infile, **kwargs):
@@ -52,10 +84,22 @@ class Defisheye:
                    "pad": 0,
                    "angle": 0,
                    "dtype": "equalarea",
-                   "format": "fullframe"
+                   "format": "fullframe",
+                   "interpolation": "linear",
+                   "border": "constant",
+                   "roi": None
                    }
         self._start_att(vkwargs, kwargs)
 
+        if self._interpolation not in INTERPOLATIONS:
+            raise NameError(
+                "Invalid interpolation {}".format(self._interpolation))
+
+        if self._border not in BORDERS:
+            raise NameError("Invalid border {}".format(self._border))
+
+        self._maps = None
+
         if type(infile) == str:
             _image = cv2.imread(infile)
         elif type(infile) == ndarray:
@@ -83,6 +127,9 @@ class Defisheye:
         self._width = self._image.shape[1]
         self._height = self._image.shape[0]
 
+        if self._roi is not None:
+            self._roi = self._clip_roi(self._roi)
+
         if self._xcenter is None:
             self._xcenter = (self._width - 1) // 2
 
@@ -96,7 +143,24 @@ class Defisheye:
 
         rd = hypot(xd, yd)
         phiang = arctan(ofocinv * rd)
+        rr = self._rr(phiang, dim)
+
+        rdmask = rd != 0
+        xs = xd.astype(np.float32).copy()
+        ys = yd.astype(np.float32).copy()
 
+        xs[rdmask] = (rr[rdmask] / rd[rdmask]) * xd[rdmask] + self._xcenter
+        ys[rdmask] = (rr[rdmask] / rd[rdmask]) * yd[rdmask] + self._ycenter
+
+        xs[~rdmask] = 0
+        ys[~rdmask] = 0
+
+        return xs, ys
+
+    def _rr(self, phiang, dim):
+        """
+        Fisheye radius of rays at angle phiang from the optical axis.
+        """
         if self._dtype == "linear":
             ifoc = dim * 180 / (self._fov * pi)
             rr = ifoc * phiang
@@ -116,19 +180,129 @@ class Defisheye:
             ifoc = dim / (2.0 * tan(self._fov * pi / 720))
             rr = ifoc * tan(phiang / 2)
 
+        return rr
+
+    def _view_map(self, i, j, ofocinv, dim, yaw, pitch):
+        """
+        Map of a perspective view rotated by pitch (degrees, positive up)
+        and then yaw (degrees, positive right) from the optical axis.
+        Also returns the mask of the rays outside the fisheye fov, which
+        are sent to -1 so the constant border leaves them black.
+        """
+        xd = (i - self._xcenter) * ofocinv
+        yd = (j - self._ycenter) * ofocinv
+
+        yaw = yaw * pi / 180
+        pitch = pitch * pi / 180
+
+        # rays (xd, yd, 1) of the view, in fisheye camera coordinates
+        yr = yd * cos(pitch) - sin(pitch)
+        zr = yd * sin(pitch) + cos(pitch)
+        xr = xd * cos(yaw) + zr * sin(yaw)
+        zr = -xd * sin(yaw) + zr * cos(yaw)
+
+        rd = hypot(xr, yr)
+        phiang = arctan2(rd, zr)
+        rr = self._rr(phiang, dim)
+
         rdmask = rd != 0
-        xs = xd.astype(np.float32).copy()
-        ys = yd.astype(np.float32).copy()
+        xs = np.full(xd.shape, self._xcenter, dtype=np.float32)
+        ys = np.full(yd.shape, self._ycenter, dtype=np.float32)
 
-        xs[rdmask] = (rr[rdmask] / rd[rdmask]) * xd[rdmask] + self._xcenter
-        ys[rdmask] = (rr[rdmask] / rd[rdmask]) * yd[rdmask] + self._ycenter
+        xs[rdmask] = (rr[rdmask] / rd[rdmask]) * xr[rdmask] + self._xcenter
+        ys[rdmask] = (rr[rdmask] / rd[rdmask]) * yr[rdmask] + self._ycenter
 
-        xs[~rdmask] = 0
-        ys[~rdmask] = 0
+        outside = phiang > self._fov * pi / 360
+        xs[outside] = -1
+        ys[outside] = -1
 
-        return xs, ys
+        return xs, ys, outside
 
-    def convert(self, outfile=None):
+    def _clip_roi(self, roi):
+        """
+        Clip the (x, y, width, height) roi to the output frame.
+        """
+        if len(roi) != 4:
+            raise ValueError("Invalid roi {}".format(roi))
+
+        x, y, width, height = [int(v) for v in roi]
+        x0, y0 = max(x, 0), max(y, 0)
+        xf, yf = min(x + width, self._width), min(y + height, self._height)
+
+        if xf <= x0 or yf <= y0:
+            raise ValueError("Invalid roi {}".format(roi))
+
+        return x0, y0, xf - x0, yf - y0
+
+    def _roi_box(self, ofoc):
+        """
+        Bounding box of the roi pixels that map into the fisheye disc.
+
+        The disc edge (rr = dim / 2) corresponds to phiang = fov / 2 for
+        every dtype, so in the output it is a circle of radius
+        ofoc * tan(fov / 2) around the center.
+
+        Returns the box (x0, y0, x1, y1), or None if it is empty, and a
+        uint8 mask of the disc pixels in the box, or None if the disc
+        covers the whole box.
+        """
+        x0, y0, width, height = self._roi
+        x1, y1 = x0 + width, y0 + height
+
+        if self._fov >= 180:
+            return (x0, y0, x1, y1), None
+
+        rdmax = ofoc * tan(self._fov * pi / 360)
+        x0 = max(x0, int(np.ceil(self._xcenter - rdmax)))
+        y0 = max(y0, int(np.ceil(self._ycenter - rdmax)))
+        x1 = min(x1, int(np.floor(self._xcenter + rdmax)) + 1)
+        y1 = min(y1, int(np.floor(self._ycenter + rdmax)) + 1)
+
+        if x1 <= x0 or y1 <= y0:
+            return None, None
+
+        i, j = meshgrid(arange(x0, x1), arange(y0, y1))
+        inside = (i - self._xcenter) ** 2.0 + (j - self._ycenter) ** 2.0 \
+            <= rdmax ** 2
+        if not inside.any():
+            return None, None
+        if inside.all():
+            return (x0, y0, x1, y1), None
+        return (x0, y0, x1, y1), inside.astype(np.uint8)
+
+    def _build_maps(self):
+        """
+        Compute the remap tables once and keep them for the next calls.
+        The nearest tier uses OpenCV fixed-point maps, which remap faster
+        with the same output; the other tiers keep float maps, since
+        fixed-point maps change the interpolated values.
+        With a roi the maps cover only the box of the roi pixels inside
+        the fisheye disc, with a mask of the disc when it cuts the box.
+        """
+        if self._maps is not None:
+            return self._maps
+
+        dim, ofocinv = self._focal()
+
+        if self._roi is None:
+            box, mask = (0, 0, self._width, self._height), None
+        else:
+            box, mask = self._roi_box(1.0 / ofocinv)
+
+        xs = ys = None
+        if box is not None:
+            x0, y0, x1, y1 = box
+            i, j = meshgrid(arange(x0, x1), arange(y0, y1))
+            xs, ys, = self._map(i, j, ofocinv, dim)
+            xs, ys = self._remap_tables(xs, ys)
+
+        self._maps = (xs, ys, box, mask)
+        return self._maps
+
+    def _focal(self):
+        """
+        Fisheye disc diameter and inverse of the output focal length.
+        """
         if self._format == "circular":
             dim = min(self._width, self._height)
         elif self._format == "fullframe":
@@ -144,15 +318,133 @@ class Defisheye:
         # f= (N/2)/tan((fov/2)*(pi/180)) = N/(2*tan(fov*pi/360))
 
         ofoc = dim / (2 * tan(self._pfov * pi / 360))
-        ofocinv = 1.0 / ofoc
+        return dim, 1.0 / ofoc
+
+    def _remap_tables(self, xs, ys):
+        """
+        Convert float maps to the format used by cv2.remap for the
+        interpolation tier.
+        """
+        if self._interpolation == "nearest":
+            xs, ys = cv2.convertMaps(xs, ys, cv2.CV_16SC2,
+                                     nninterpolation=True)
+        return xs, ys
+
+    def _build_view_maps(self, yaw, pitch):
+        """
+        Remap tables of one view, cached for the camera.
+        """
+        # Only the nearest tier converts the float maps (_remap_tables)
+        key = (self._width, self._height, self._xcenter, self._ycenter,
+               self._radius, self._fov, self._pfov, self._dtype,
+               self._format, self._interpolation == "nearest", yaw, pitch)
+
+        with _VIEW_LOCK:
+            if key in _VIEW_MAPS:
+                return _VIEW_MAPS[key][0]
+            building = _VIEW_BUILDING.setdefault(key, threading.Lock())
+
+        try:
+            with building:
+                with _VIEW_LOCK:
+                    if key in _VIEW_MAPS:
+                        return _VIEW_MAPS[key][0]
+
+                dim, ofocinv = self._focal()
+
+                i = arange(self._width)
+                j = arange(self._height)
+                i, j = meshgrid(i, j)
+
+                xs, ys, outside = self._view_map(i, j, ofocinv, dim,
+                                                 yaw, pitch)
+                inside = None
+                if outside.any():
+                    inside = (~outside).astype(np.uint8)
+                maps = self._remap_tables(xs, ys) + (inside,)
+                nbytes = sum(m.nbytes for m in maps if m is not None)
+
+                with _VIEW_LOCK:
+                    if nbytes <= VIEW_CACHE_BYTES:
+                        used = sum(v[1] for v in _VIEW_MAPS.values())
+                        while used + nbytes > VIEW_CACHE_BYTES:
+                            used -= _VIEW_MAPS.pop(next(iter(_VIEW_MAPS)))[1]
+                        _VIEW_MAPS[key] = (maps, nbytes)
+        finally:
+            with _VIEW_LOCK:
+                if _VIEW_BUILDING.get(key) is building:
+                    del _VIEW_BUILDING[key]
+        return maps
+
+    @staticmethod
+    def clear_view_cache():
+        """
+        Free the remap tables cached by convert_views.
+        """
+        with _VIEW_LOCK:
+            _VIEW_MAPS.clear()
+
+    def convert_views(self, views, outfile=None, workers=None):
+        """
+        Render several perspective views from the fisheye image.
 
-        i = arange(self._width)
-        j = arange(self._height)
-        i, j = meshgrid(i, j)
+        views: list of (yaw, pitch) pairs in degrees. yaw turns the view
+               to the right and pitch up, from the optical axis.
+        outfile: each view is saved with _yaw<yaw>_pitch<pitch> appended
+                 to the file name.
+        workers: number of threads rendering the views.
+
+        The roi option is not used by the views (the CLI rejects both). Parts of a view outside
+        the fisheye fov are black; border only applies inside the fov.
+        """
+        def render(view):
+            yaw, pitch = view
+            xs, ys, inside = self._build_view_maps(yaw, pitch)
+            img = self._remap(xs, ys)
+            # Other border modes fill the out-of-fov pixels with image content
+            if inside is not None and self._border != "constant":
+                img = cv2.bitwise_and(img, img, mask=inside)
+            return img
+
+        views = list(views)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            imgs = list(executor.map(render, views))
+
+        if outfile is not None:
+            base, ext = os.path.splitext(outfile)
+            for (yaw, pitch), img in zip(views, imgs):
+                cv2.imwrite("{}_yaw{:g}_pitch{:g}{}".format(
+                    base, yaw, pitch, ext), img)
+        return imgs
+
+    def _remap(self, xs, ys):
+        return cv2.remap(self._image, xs, ys,
+                         INTERPOLATIONS[self._interpolation],
+                         borderMode=BORDERS[self._border])
+
+    def convert(self, outfile=None):
+        xs, ys, box, mask = self._build_maps()
+
+        if self._roi is None:
+            x0, y0, width, height = 0, 0, self._width, self._height
+        else:
+            x0, y0, width, height = self._roi
+
+        if box is None:
+            img = np.zeros((height, width) + self._image.shape[2:],
+                           dtype=self._image.dtype)
+        else:
+            img = self._remap(xs, ys)
+            if mask is not None:
+                img = cv2.bitwise_and(img, img, mask=mask)
 
-        xs, ys, = self._map(i, j, ofocinv, dim)
+            bx0, by0, bx1, by1 = box
+            if box != (x0, y0, x0 + width, y0 + height):
+                values = img
+                img = np.zeros((height, width) + self._image.shape[2:],
+                               dtype=self._image.dtype)
+                img[by0 - y0:by1 - y0, bx0 - x0:bx1 - x0] = values
 
-        img = cv2.remap(self._image, xs, ys, cv2.INTER_LINEAR)
         if outfile is not None:
             cv2.imwrite(outfile, img)
         return img
@@ -39,7 +39,7 @@ from tkinter import messagebox
 import cv2
 from PIL import Image
 
-from .defisheye import Defisheye
+from .defisheye import Defisheye, INTERPOLATIONS, BORDERS
 import io
 import base64
 
@@ -135,6 +135,18 @@ class DefisheyeApp:
         self._xpand.set(0)
         self._xpand_entry['textvariable'] = self._xpand
 
+        self._interpolation_combo = self.builder.get_object("combointerpolation")
+        self._interpolation_combo['values'] = tuple(INTERPOLATIONS)
+        self._interpolation_combo.current(1)
+        self._interpolation.set(self._interpolation_combo['values'][1])
+        self._interpolation_combo['textvariable'] = self._interpolation
+
+        self._border_combo = self.builder.get_object("comboborder")
+        self._border_combo['values'] = tuple(BORDERS)
+        self._border_combo.current(0)
+        self._border.set(self._border_combo['values'][0])
+        self._border_combo['textvariable'] = self._border
+
     def _current_kwargs(self):
         return {
             "fov": self._fov.get(),
@@ -145,7 +157,9 @@ class DefisheyeApp:
             "pad": self._xpand.get() if self._xpand.get() > 0 else 0,
             "angle": self._angle.get() if self._angle.get() != -1 else None,
             "dtype": self._dtype.get(),
-            "format": self._format.get()
+            "format": self._format.get(),
+            "interpolation": self._interpolation.get(),
+            "border": self._border.get()
         }
 
     def _photo_image_from_pil(self, image: Image.Image) -> tk.PhotoImage:
@@ -166,6 +180,8 @@ class DefisheyeApp:
 
         self._dtype = tk.StringVar()
         self._format = tk.StringVar()
+        self._interpolation = tk.StringVar()
+        self._border = tk.StringVar()
 
         self._xpand = tk.IntVar()
 
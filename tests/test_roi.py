@@ -0,0 +1,29 @@
+import numpy as np
+from numpy import pi, tan
+
+from defisheye import Defisheye
+
+
+def test_roi_matches_cropped_output():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (400, 400, 3), dtype=np.uint8)
+    kwargs = {"format": "circular", "fov": 120, "pfov": 150}
+
+    full = Defisheye(image, **kwargs).convert()
+
+    # Tall strip through the center: its middle rows are fully inside the
+    # disc, the top and bottom rows are cut by the disc edge.
+    obj = Defisheye(image, roi=(150, 0, 100, 400), **kwargs)
+    img = obj.convert()
+    x0, y0, width, height = obj._roi
+
+    dim, ofocinv = obj._focal()
+    rdmax = tan(kwargs["fov"] * pi / 360) / ofocinv
+    i, j = np.meshgrid(np.arange(x0, x0 + width), np.arange(y0, y0 + height))
+    inside = (i - obj._xcenter) ** 2.0 + (j - obj._ycenter) ** 2.0 <= rdmax ** 2
+
+    assert img.shape == (height, width, 3)
+    assert inside.all(axis=1).any() and not inside.all()
+    crop = full[y0:y0 + height, x0:x0 + width]
+    assert np.array_equal(img[inside], crop[inside])
+    assert not img[~inside].any()